@@ -1,7 +1,10 @@
-import os, uuid, sqlite3, datetime as dt
-from typing import List, Tuple, Optional, Dict, Any
+import io, os, re, uuid, sqlite3, hashlib, datetime as dt
+import atexit, functools, queue, threading, time
+from contextlib import contextmanager
+from typing import List, Tuple, Optional, Dict, Any, Iterator, Union, Callable
+import pandas as pd
 import streamlit as st
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageFont
 import json
 import base64
 import mimetypes
@@ -11,8 +14,7 @@ import mimetypes
 # ============================================================
 APP_TITLE = "Enterprise DMS + Work Management Prototype"
 DB_PATH = "dms.sqlite3"
-FILES_DIR = "dms_files"
-os.makedirs(FILES_DIR, exist_ok=True)
+FILES_DIR = "dms_files"  # created by _bootstrap(), which main() runs before any page writes files
 
 # ============================================================
 # Document Preview Configuration
@@ -30,14 +32,8 @@ PREVIEWABLE_TYPES = {
 
 MAX_PREVIEW_SIZE = 10 * 1024 * 1024  # 10MB max for preview
 MAX_TEXT_PREVIEW = 50000  # Max characters for text preview
-
-# ============================================================
-# App configuration
-# ============================================================
-APP_TITLE = "Enterprise DMS + Work Management Prototype"
-DB_PATH = "dms.sqlite3"
-FILES_DIR = "dms_files"
-os.makedirs(FILES_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB chunks when writing uploads to disk
+UPLOAD_EVICT_SIZE = 10 * 1024 * 1024  # uploads above 10MB are fsynced and dropped from page cache
 
 # ============================================================
 # Domain configuration
@@ -45,6 +41,7 @@ os.makedirs(FILES_DIR, exist_ok=True)
 DOCUMENT_TYPES = ["Policy", "Procedure", "Contract", "Invoice", "PO", "Drawing", "Other"]
 DEPARTMENTS = ["Shared Services", "HR", "Finance", "Procurement", "IT", "Operations", "Legal", "Sales", "Marketing", "Engineering"]
 SENSITIVITY = ["Public", "Internal", "Confidential", "Restricted"]
+BROWSE_PAGE_SIZE = 25  # documents per Search & Browse page
 RETENTION_POLICIES = {
     "Business record (7y)": 7,
     "Contract life + 6y": 6,
@@ -77,6 +74,12 @@ APPROVAL_WORKFLOWS = {
     }
 }
 
+# Step list shown when picking a workflow; rendered once as a single markdown element
+WORKFLOW_STEP_PREVIEWS = {
+    name: "Approval steps:\n\n" + "\n".join(f"{i}. {step}" for i, step in enumerate(workflow["steps"], 1))
+    for name, workflow in APPROVAL_WORKFLOWS.items()
+}
+
 # Workflow step action types
 STEP_ACTIONS = {
     "review": "Review Document",
@@ -87,6 +90,9 @@ STEP_ACTIONS = {
     "route": "Route to Next Step"
 }
 
+# Document status badges shown in the viewer header
+STATUS_ICONS = {"Draft": "🟡", "Review": "🔵", "Approved": "🟢", "Rejected": "🔴"}
+
 # Workflow triggers and conditions
 WORKFLOW_TRIGGERS = {
     "document_type": "Document Type",
@@ -124,8 +130,19 @@ SEED_USERS = [
     ("u-procmgr", "Procurement Manager", "procmgr@example.com", "Procurement Manager"),
 ]
 
+_now_cache = (0, "")  # (epoch second, its formatted timestamp); swapped atomically
+
 def now_iso() -> str:
-    return dt.datetime.utcnow().isoformat(timespec="seconds")
+    """UTC timestamp to the second, formatted once per second"""
+    global _now_cache
+    second = int(time.time())
+    if second != _now_cache[0]:
+        _now_cache = (second, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second)))
+    return _now_cache[1]
+
+# Bind dates/datetimes directly, stored in the same ISO text form as now_iso()
+sqlite3.register_adapter(dt.date, dt.date.isoformat)
+sqlite3.register_adapter(dt.datetime, lambda d: d.isoformat(timespec="seconds"))
 
 # ============================================================
 # Integration stubs
@@ -150,12 +167,185 @@ pa_client = PowerAutomateClientStub()
 # ============================================================
 # DB Setup
 # ============================================================
+DB_READERS = 4
+DB_CACHED_STATEMENTS = 256
+# Per-connection settings; journal_mode=WAL is persistent and set once in init_db().
+# journal_size_limit truncates the WAL back to 64 MB after a checkpoint instead of leaving it at its peak.
+SQLITE_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-64000;
+    PRAGMA mmap_size=268435456;
+    PRAGMA foreign_keys=ON;
+    PRAGMA journal_size_limit=67108864;
+"""
+
 def connect():
-    return sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+    conn.executescript(SQLITE_PRAGMAS)
+    return conn
+
+class ConnectionPool:
+    """One shared writer connection plus a queue of reader connections.
+
+    Writes are serialised through a re-entrant lock; nested ``write()`` blocks
+    join the outermost transaction, which commits (or rolls back) on exit.
+    Callbacks registered with ``after_commit()`` run once that commit lands.
+    Reads issued by the thread holding the writer reuse it so they see their
+    own uncommitted changes.
+    """
+    def __init__(self, readers: int = DB_READERS):
+        self._writer = connect()
+        # Take the database write lock when the transaction opens, not on its first write,
+        # so another process's writer makes us wait (busy timeout) instead of failing mid-way
+        self._writer.isolation_level = "IMMEDIATE"
+        self._write_lock = threading.RLock()
+        self._write_owner: Optional[int] = None
+        self._write_depth = 0
+        self._after_commit: List[Callable[[], None]] = []
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(connect())
+        atexit.register(self.close)
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        callbacks: List[Callable[[], None]] = []
+        with self._write_lock:
+            self._write_owner = threading.get_ident()
+            self._write_depth += 1
+            try:
+                yield self._writer
+            except BaseException:
+                if self._write_depth == 1:
+                    self._writer.rollback()
+                    self._after_commit.clear()
+                raise
+            else:
+                if self._write_depth == 1:
+                    self._writer.commit()
+                    callbacks, self._after_commit = self._after_commit, []
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._write_owner = None
+        for callback in callbacks:
+            callback()
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Run callback once the outermost write() commits, or now if no write is open"""
+        if self.in_write():
+            self._after_commit.append(callback)
+        else:
+            callback()
+
+    def in_write(self) -> bool:
+        """Whether the calling thread is inside a write() block"""
+        return self._write_owner == threading.get_ident()
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        if self.in_write():
+            yield self._writer
+            return
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self):
+        """Close every idle connection; closing the last one checkpoints and removes the WAL"""
+        with self._write_lock:
+            self._writer.execute("PRAGMA optimize")
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+@st.cache_resource(show_spinner=False)
+def get_pool() -> ConnectionPool:
+    return ConnectionPool()
+
+def read_conn():
+    return get_pool().read()
+
+def write_conn():
+    return get_pool().write()
+
+# Hot statements, kept as fixed strings so each pooled connection's statement cache serves them
+SQL_INSERT_AUDIT = "INSERT INTO audit (entity, entity_id, action, actor, at, details) VALUES (?,?,?,?,?,?)"
+SQL_INSERT_DOCUMENT = """INSERT INTO documents
+    (id, title, department, doc_type, sensitivity, tags, retention_policy, retention_years,
+     status, effective_date, expiry_date, created_at, created_by, active)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,1)"""
+SQL_INSERT_APPROVAL = """INSERT INTO approvals
+    (document_id, assigned_to, status, comment, created_at, decided_at)
+    VALUES (?,?,?,?,?,?)"""
+SQL_INSERT_VERSION = """INSERT INTO versions
+    (document_id, version, file_path, note, created_at, created_by)
+    VALUES (?,?,?,?,?,?)"""
+SQL_INSERT_TICKET = """INSERT INTO tickets
+    (id, requester, process_type, linked_document_id, status, priority, sla_hours, notes, assigned_to, created_at, closed_at)
+    VALUES (?,?,?,?, 'Open', ?, ?, ?, ?, ?, '')"""
+SQL_LATEST_VERSION = "SELECT current_version FROM documents WHERE id=?"
+SQL_SET_CURRENT_VERSION = """UPDATE documents SET current_version=?, latest_path=?
+    WHERE id=? AND IFNULL(current_version, 0) < ?"""
+SQL_INSERT_DOCUMENT_TAG = "INSERT OR IGNORE INTO document_tags (document_id, tag) VALUES (?,?)"
+SQL_INSERT_SIGNATURE = """INSERT INTO signatures
+    (document_id, signer, method, image_path, signed_at)
+    VALUES (?,?,?,?,?)"""
+SQL_INSERT_ANNOTATION = """INSERT INTO document_annotations
+    (id, document_id, version, author, annotation_type, content, position_data, created_at)
+    VALUES (?,?,?,?,?,?,?,?)"""
+SQL_UPLOAD_BY_HASH = "SELECT path FROM upload_blobs WHERE sha256=?"
+SQL_RECORD_UPLOAD = "INSERT OR REPLACE INTO upload_blobs (sha256, path) VALUES (?,?)"
+SQL_PENDING_COUNT = "SELECT COUNT(*) FROM approvals WHERE assigned_to=? AND status='pending'"
+PENDING_COUNT_TTL = 30  # seconds; bounds staleness from writes made by another process
+SQL_LIST_VERSIONS = """SELECT version, file_path, created_at, created_by, note
+    FROM versions WHERE document_id=? ORDER BY version DESC"""
+SQL_DOCUMENT_APPROVALS = """SELECT a.id, a.assigned_to, a.status, a.comment, a.created_at, a.decided_at,
+           u.name AS user_name, u.role AS user_role
+    FROM approvals a
+    JOIN users u ON a.assigned_to = u.id
+    WHERE a.document_id=?
+    ORDER BY a.created_at, a.id"""
+
+def _create_without_rowid(cur, table: str, create_sql: str):
+    """Create a WITHOUT ROWID table, rebuilding an existing rowid table in place"""
+    cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    row = cur.fetchone()
+    if row and "WITHOUT ROWID" in row[0].upper():
+        return
+    if row:
+        cur.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    cur.execute(create_sql)
+    if row:
+        cols = ", ".join(r[1] for r in cur.execute(f"PRAGMA table_info({table}_old)").fetchall())
+        cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {table}_old")
+        cur.execute(f"DROP TABLE {table}_old")
+
+def _create_integer_keyed(cur, table: str, create_sql: str, order_by: str):
+    """Create a table keyed by its rowid, rebuilding one with TEXT ids in place (ordered by order_by)"""
+    info = cur.execute(f"PRAGMA table_info({table})").fetchall()
+    rekey = any(r[1] == "id" and r[2].upper() != "INTEGER" for r in info)
+    if rekey:
+        cur.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    cur.execute(create_sql)
+    if rekey:
+        keep = ", ".join(r[1] for r in info if r[1] != "id")
+        cur.execute(f"INSERT INTO {table} ({keep}) SELECT {keep} FROM {table}_old ORDER BY {order_by}")
+        cur.execute(f"DROP TABLE {table}_old")
 
 def init_db():
-    conn = connect()
-    cur = conn.cursor()
+    with write_conn() as conn:
+        if DB_PATH != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        _create_schema(conn.cursor())
+
+def _create_schema(cur):
 
     # Original tables
     cur.execute("""CREATE TABLE IF NOT EXISTS users (
@@ -168,50 +358,62 @@ def init_db():
     cur.execute("""CREATE TABLE IF NOT EXISTS documents (
         id TEXT PRIMARY KEY,
         title TEXT NOT NULL,
-        department TEXT,
-        doc_type TEXT,
-        sensitivity TEXT,
+        department TEXT COLLATE NOCASE,
+        doc_type TEXT COLLATE NOCASE,
+        sensitivity TEXT COLLATE NOCASE,
         tags TEXT,
         retention_policy TEXT,
         retention_years INTEGER,
-        status TEXT,
+        status TEXT COLLATE NOCASE,
         effective_date TEXT,
         expiry_date TEXT,
         created_at TEXT,
         created_by TEXT,
-        active INTEGER DEFAULT 1
+        active INTEGER DEFAULT 1,
+        current_version INTEGER DEFAULT 0,
+        latest_path TEXT
     )""")
 
-    cur.execute("""CREATE TABLE IF NOT EXISTS versions (
-        id TEXT PRIMARY KEY,
+    # Version, approval, signature and audit ids are internal only, so they are the rowid
+    _create_integer_keyed(cur, "versions", """CREATE TABLE IF NOT EXISTS versions (
+        id INTEGER PRIMARY KEY,
         document_id TEXT NOT NULL,
         version INTEGER NOT NULL,
         file_path TEXT NOT NULL,
         note TEXT,
         created_at TEXT,
         created_by TEXT
-    )""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS approvals (
-        id TEXT PRIMARY KEY,
+    )""", "document_id, version")
+
+    # Newest version number/path kept on documents so uploads and "latest" lookups skip versions
+    if "current_version" not in {r[1] for r in cur.execute("PRAGMA table_info(documents)").fetchall()}:
+        cur.execute("ALTER TABLE documents ADD COLUMN current_version INTEGER DEFAULT 0")
+        cur.execute("ALTER TABLE documents ADD COLUMN latest_path TEXT")
+        cur.execute("""UPDATE documents SET (current_version, latest_path) =
+                           (SELECT version, file_path FROM versions v WHERE v.document_id = documents.id
+                            ORDER BY version DESC LIMIT 1)
+                       WHERE id IN (SELECT document_id FROM versions)""")
+
+    _create_integer_keyed(cur, "approvals", """CREATE TABLE IF NOT EXISTS approvals (
+        id INTEGER PRIMARY KEY,
         document_id TEXT NOT NULL,
         assigned_to TEXT NOT NULL,
         status TEXT NOT NULL,
         comment TEXT,
         created_at TEXT,
         decided_at TEXT
-    )""")
+    )""", "rowid")
 
-    cur.execute("""CREATE TABLE IF NOT EXISTS signatures (
-        id TEXT PRIMARY KEY,
+    _create_integer_keyed(cur, "signatures", """CREATE TABLE IF NOT EXISTS signatures (
+        id INTEGER PRIMARY KEY,
         document_id TEXT NOT NULL,
         signer TEXT NOT NULL,
         method TEXT,
         image_path TEXT,
         signed_at TEXT
-    )""")
+    )""", "rowid")
 
-    cur.execute("""CREATE TABLE IF NOT EXISTS tickets (
+    _create_without_rowid(cur, "tickets", """CREATE TABLE IF NOT EXISTS tickets (
         id TEXT PRIMARY KEY,
         requester TEXT NOT NULL,
         process_type TEXT NOT NULL,
@@ -223,17 +425,18 @@ def init_db():
         assigned_to TEXT,
         created_at TEXT,
         closed_at TEXT
-    )""")
+    ) WITHOUT ROWID""")
 
-    cur.execute("""CREATE TABLE IF NOT EXISTS audit (
-        id TEXT PRIMARY KEY,
+    # Appends land on the rightmost B-tree page instead of at a random UUID position
+    _create_integer_keyed(cur, "audit", """CREATE TABLE IF NOT EXISTS audit (
+        id INTEGER PRIMARY KEY,
         entity TEXT,
         entity_id TEXT,
         action TEXT,
         actor TEXT,
         at TEXT,
         details TEXT
-    )""")
+    )""", "at")
 
     # NEW: Custom workflow tables
     cur.execute("""CREATE TABLE IF NOT EXISTS custom_workflows (
@@ -290,6 +493,27 @@ def init_db():
         FOREIGN KEY (step_id) REFERENCES workflow_steps(id)
     )""")
 
+    # First stored copy of each distinct upload; identical uploads hard-link to it
+    cur.execute("""CREATE TABLE IF NOT EXISTS upload_blobs (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT NOT NULL
+    ) WITHOUT ROWID""")
+
+    # Normalised document tags (documents.tags keeps the display/FTS copy)
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='document_tags'")
+    tags_exist = cur.fetchone() is not None
+    cur.execute("""CREATE TABLE IF NOT EXISTS document_tags (
+        document_id TEXT NOT NULL,
+        tag TEXT NOT NULL COLLATE NOCASE,
+        PRIMARY KEY (document_id, tag)
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tag ON document_tags(tag)")
+    if not tags_exist:
+        cur.execute("SELECT id, tags FROM documents WHERE tags <> ''")
+        cur.executemany(SQL_INSERT_DOCUMENT_TAG,
+                        [(doc_id, t.strip()) for doc_id, tags in cur.fetchall()
+                         for t in tags.split(",") if t.strip()])
+
     # Document annotations and notes
     cur.execute("""CREATE TABLE IF NOT EXISTS document_annotations (
         id TEXT PRIMARY KEY,
@@ -303,46 +527,149 @@ def init_db():
         FOREIGN KEY (document_id) REFERENCES documents(id)
     )""")
 
-    conn.commit()
-    conn.close()
+    # Full-text index over the searchable document columns, kept in sync by triggers
+    cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='documents_fts'")
+    row = cur.fetchone()
+    fts_exists = row is not None and "prefix=" in row[0]
+    if row and not fts_exists:
+        # Built with an older tokenizer or without prefix indexes; recreate and reindex below
+        cur.execute("DROP TABLE documents_fts")
+    # _fts_query matches every word as a prefix; prefix indexes keep short ones from range-scanning
+    cur.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+        title, tags, department, doc_type,
+        content='documents', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS documents_fts_ai AFTER INSERT ON documents BEGIN
+        INSERT INTO documents_fts(rowid, title, tags, department, doc_type)
+        VALUES (new.rowid, new.title, new.tags, new.department, new.doc_type);
+    END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS documents_fts_ad AFTER DELETE ON documents BEGIN
+        INSERT INTO documents_fts(documents_fts, rowid, title, tags, department, doc_type)
+        VALUES ('delete', old.rowid, old.title, old.tags, old.department, old.doc_type);
+    END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS documents_fts_au AFTER UPDATE OF title, tags, department, doc_type ON documents BEGIN
+        INSERT INTO documents_fts(documents_fts, rowid, title, tags, department, doc_type)
+        VALUES ('delete', old.rowid, old.title, old.tags, old.department, old.doc_type);
+        INSERT INTO documents_fts(rowid, title, tags, department, doc_type)
+        VALUES (new.rowid, new.title, new.tags, new.department, new.doc_type);
+    END""")
+    if not fts_exists:
+        cur.execute("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')")
+
+    # Indexes for hot approval/ticket/version/audit lookups
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_appr_assigned ON approvals(assigned_to, status, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_appr_doc ON approvals(document_id, status, created_at)")
+    # Recent decisions per approver, read newest-first with LIMIT and no sort step
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_appr_decided ON approvals(assigned_to, decided_at DESC)
+                   WHERE status IN ('approved', 'rejected')""")
+    cur.execute("DROP INDEX IF EXISTS idx_ver_doc_path")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ver_doc ON versions(document_id, version DESC)")
+    cur.execute("DROP INDEX IF EXISTS idx_tick_req")
+    cur.execute("DROP INDEX IF EXISTS idx_tick_assn")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_requester ON tickets(requester, created_at DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_assignee ON tickets(assigned_to, created_at DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_at ON audit(at DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit(entity, entity_id, at)")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_doc_filters ON documents(
+        department COLLATE NOCASE, doc_type COLLATE NOCASE, sensitivity COLLATE NOCASE,
+        status COLLATE NOCASE, created_at DESC)""")
+    # Browse order, so an unfiltered (or status/tag-only) page reads its LIMIT rows without sorting
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_doc_created ON documents(created_at DESC, id)")
+    # Workflow and annotation lookups are all keyed by their parent id
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_wf_steps ON workflow_steps(workflow_id, step_order)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_wf_inst_doc ON workflow_instances(document_id, status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_wf_inst_wf ON workflow_instances(workflow_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_step_exec_inst ON step_executions(workflow_instance_id, step_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_annot_doc ON document_annotations(document_id, version DESC, created_at)")
+
+    # Gather planner statistics on first run; afterwards only refresh what has drifted
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'")
+    cur.execute("PRAGMA optimize" if cur.fetchone() else "ANALYZE")
 
 def seed_users():
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users")
-    if (cur.fetchone() or [0])[0] == 0:
-        cur.executemany("INSERT INTO users (id,name,email,role) VALUES (?,?,?,?)", SEED_USERS)
-        conn.commit()
-    conn.close()
+    with write_conn() as conn:
+        inserted = conn.executemany("INSERT OR IGNORE INTO users (id,name,email,role) VALUES (?,?,?,?)",
+                                    SEED_USERS).rowcount
+    if not inserted:
+        # Already seeded; keep the user caches warm
+        return
+    get_users_cached.clear()
+    get_users_by_role.clear()
+    get_users_by_name_map.clear()
+    get_process_assignees.clear()
 
 def add_audit(entity: str, entity_id: str, action: str, actor: str, details: str = ""):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO audit (id, entity, entity_id, action, actor, at, details) VALUES (?,?,?,?,?,?,?)",
-        (str(uuid.uuid4()), entity, entity_id, action, actor, now_iso(), details)
-    )
-    conn.commit()
-    conn.close()
+    with write_conn() as conn:
+        conn.execute(SQL_INSERT_AUDIT, (entity, entity_id, action, actor, now_iso(), details))
+
+# Rows per multi-row audit INSERT; 999 is the lowest SQLITE_MAX_VARIABLE_NUMBER across builds
+AUDIT_BATCH_ROWS = 999 // 6
+
+@functools.lru_cache(maxsize=None)
+def _audit_insert_sql(rows: int) -> str:
+    """Multi-row audit INSERT text, built once per batch size"""
+    return SQL_INSERT_AUDIT + ",(?,?,?,?,?,?)" * (rows - 1)
+
+def add_audit_bulk(entries: List[Tuple[str, str, str, str, str]]):
+    """Insert several (entity, entity_id, action, actor, details) audit rows in one transaction"""
+    at = now_iso()
+    rows = [(entity, entity_id, action, actor, at, details)
+            for entity, entity_id, action, actor, details in entries]
+    with write_conn() as conn:
+        for start in range(0, len(rows), AUDIT_BATCH_ROWS):
+            batch = rows[start:start + AUDIT_BATCH_ROWS]
+            conn.execute(_audit_insert_sql(len(batch)), [value for row in batch for value in row])
+
+@st.cache_data(max_entries=1)
+def _recent_audit(last_id: int) -> pd.DataFrame:
+    with read_conn() as conn:
+        return pd.read_sql_query("SELECT at, actor, entity, action, entity_id, details FROM audit ORDER BY at DESC LIMIT 50", conn)
+
+def recent_audit() -> pd.DataFrame:
+    """Last 50 audit rows, re-read only when a newer row has been written"""
+    with read_conn() as conn:
+        last_id = conn.execute("SELECT MAX(id) FROM audit").fetchone()[0]
+    return _recent_audit(last_id or 0)
 
 # ============================================================
 # Helper Functions
 # ============================================================
 def get_users() -> List[Tuple[str, str, str]]:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, role FROM users ORDER BY name")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with read_conn() as conn:
+        return conn.execute("SELECT id, name, role FROM users ORDER BY name").fetchall()
+
+@st.cache_data(ttl=300)
+def get_users_cached() -> List[Tuple[str, str, str]]:
+    return get_users()
+
+@st.cache_data(ttl=300)
+def get_users_by_name_map() -> Dict[str, Tuple[str, str, str]]:
+    """Users keyed by name, derived from the cached user list"""
+    return {user[1]: user for user in get_users_cached()}
+
+@st.cache_data(ttl=300)
+def get_users_by_role() -> Dict[str, List[Tuple[str, str, str]]]:
+    """Users grouped by role, each group ordered by name"""
+    by_role: Dict[str, List[Tuple[str, str, str]]] = {}
+    for user in get_users_cached():
+        by_role.setdefault(user[2], []).append(user)
+    return by_role
+
+def get_user_by_role(role: str) -> Optional[Tuple[str, str, str]]:
+    """First user (by name) holding role"""
+    holders = get_users_by_role().get(role)
+    return holders[0] if holders else None
 
 def get_user_by_name(name: str) -> Optional[Tuple[str, str, str]]:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, role FROM users WHERE name=?", (name,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    return get_users_by_name_map().get(name)
+
+@st.cache_data
+def get_process_assignees() -> Dict[str, List[str]]:
+    """User ids for each PROCESS_TEMPLATES step list, resolved once by name from the cached user map"""
+    by_name = get_users_by_name_map()
+    return {process: [by_name[n][0] for n in steps if n in by_name] for process, steps in PROCESS_TEMPLATES.items()}
 
 # ============================================================
 # Document Operations
@@ -350,89 +677,186 @@ def get_user_by_name(name: str) -> Optional[Tuple[str, str, str]]:
 def create_document_record(title, department, doc_type, sensitivity, tags: List[str],
                            retention_policy, retention_years: int,
                            created_by, status="Draft",
-                           effective_date: Optional[str]=None, expiry_date: Optional[str]=None,
-                           description: str = "", workflow_type: str = "") -> str:
-    doc_id = str(uuid.uuid4())
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO documents
-        (id, title, department, doc_type, sensitivity, tags, retention_policy, retention_years,
-         status, effective_date, expiry_date, created_at, created_by, active)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,1)""",
-        (doc_id, title, department, doc_type, sensitivity, ",".join(tags),
-         retention_policy, int(retention_years or 0), status,
-         effective_date or "", expiry_date or "", now_iso(), created_by))
-    conn.commit()
-    conn.close()
-    add_audit("document", doc_id, "create", created_by, f"{title} - {workflow_type}")
+                           effective_date: Optional[Union[str, dt.date]]=None, expiry_date: Optional[Union[str, dt.date]]=None,
+                           description: str = "", workflow_type: str = "",
+                           doc_id: Optional[str] = None) -> str:
+    doc_id = doc_id or uuid.uuid4().hex
+    with write_conn() as conn:
+        conn.execute(SQL_INSERT_DOCUMENT,
+            (doc_id, title, department, doc_type, sensitivity, ",".join(tags),
+             retention_policy, int(retention_years or 0), status,
+             effective_date or "", expiry_date or "", now_iso(), created_by))
+        conn.executemany(SQL_INSERT_DOCUMENT_TAG,
+                         [(doc_id, t) for t in tags])
+        add_audit("document", doc_id, "create", created_by, f"{title} - {workflow_type}")
     return doc_id
 
 def next_version(document_id: str) -> int:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(version) FROM versions WHERE document_id=?", (document_id,))
-    v = cur.fetchone()[0]
-    conn.close()
-    return (v or 0) + 1
-
-def save_upload(file, doc_id: str, version: int) -> str:
+    with read_conn() as conn:
+        row = conn.execute(SQL_LATEST_VERSION, (document_id,)).fetchone()
+    return ((row[0] if row else 0) or 0) + 1
+
+def save_upload(file, doc_id: str, version: int) -> Tuple[str, str]:
+    """Store an upload in FILES_DIR and return (path, sha256); content seen before is hard-linked, not kept twice"""
     name = f"{doc_id}_v{version}_{file.name}"
     path = os.path.join(FILES_DIR, name)
-    with open(path, "wb") as f:
-        f.write(file.getbuffer())
-    return path
-
-def add_version(document_id: str, version: int, file_path: str, created_by: str, note: str = ""):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO versions
-        (id, document_id, version, file_path, note, created_at, created_by)
-        VALUES (?,?,?,?,?,?,?)""",
-        (str(uuid.uuid4()), document_id, version, file_path, note, now_iso(), created_by))
-    conn.commit()
-    conn.close()
-    add_audit("version", document_id, f"v{version}", created_by, note)
-
-def list_documents(filters: dict):
-    conn = connect()
-    cur = conn.cursor()
-    query = "SELECT id, title, department, doc_type, sensitivity, tags, status, created_at, created_by FROM documents WHERE 1=1"
-    args = []
-    if filters.get("q"):
-        q = f"%{filters['q'].lower()}%"
-        query += " AND (LOWER(title) LIKE ? OR LOWER(tags) LIKE ? OR LOWER(department) LIKE ? OR LOWER(doc_type) LIKE ?)"
-        args += [q, q, q, q]
-    if filters.get("department"):
-        query += " AND department=?"; args.append(filters["department"])
-    if filters.get("doc_type"):
-        query += " AND doc_type=?"; args.append(filters["doc_type"])
-    if filters.get("sensitivity"):
-        query += " AND sensitivity=?"; args.append(filters["sensitivity"])
-    if filters.get("status"):
-        query += " AND status=?"; args.append(filters["status"])
-    query += " ORDER BY created_at DESC"
-    cur.execute(query, args)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    # Files are only ever swapped in with os.replace, so writing never touches a linked copy's data
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    file.seek(0)
+    with open(tmp, "wb") as f:
+        for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            f.write(chunk)
+        sha256 = digest.hexdigest()
+        with read_conn() as conn:
+            row = conn.execute(SQL_UPLOAD_BY_HASH, (sha256,)).fetchone()
+        linked = False
+        if row:
+            link = f"{tmp}.link"
+            try:
+                os.link(row[0], link)
+                # Keep the stored copy in place of the bytes just written, so only one stays on disk
+                os.replace(link, tmp)
+                linked = True
+            except OSError:
+                pass  # the stored copy is gone or can't be linked from here; keep the fresh one
+        if not linked and hasattr(os, "posix_fadvise") and f.tell() > UPLOAD_EVICT_SIZE:
+            # Large uploads are rarely read back soon; sync them and let the kernel drop them
+            # from page cache. Small ones stay cached and skip the fsync.
+            f.flush()
+            os.fdatasync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    os.replace(tmp, path)
+    return path, sha256
+
+@st.cache_data(ttl=300, max_entries=64)
+def _read_file_bytes(path: str, mtime: float) -> bytes:
+    """File contents for download buttons; mtime keys the cache so edits invalidate it"""
+    with open(path, "rb") as fh:
+        return fh.read()
+
+@st.cache_data(ttl=60, max_entries=1)
+def _read_large_file_bytes(path: str, mtime: float) -> bytes:
+    """Like _read_file_bytes, but holds a single file briefly so large downloads aren't re-read per rerun"""
+    with open(path, "rb") as fh:
+        return fh.read()
+
+def lazy_download_button(label: str, path: str, key: str, **kwargs):
+    """Download button that only touches the file once the user asks for it"""
+    # Keyed by widget key and path: some callers use positional keys, which alone would carry
+    # the flag over to another document after paging; path alone would prepare every button for the file
+    flag = f"download_prepared_{key}_{path}"
+    if not st.session_state.get(flag):
+        if st.button(f"Prepare {label.lower()}", key=f"{key}_prepare"):
+            st.session_state[flag] = True
+            st.rerun()
+        return
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        st.warning("File not found")
+        return
+    if stat.st_size > MAX_PREVIEW_SIZE:
+        # Keep large files out of the 64-entry download cache
+        data = _read_large_file_bytes(path, stat.st_mtime)
+    else:
+        data = _read_file_bytes(path, stat.st_mtime)
+    kwargs.setdefault("file_name", os.path.basename(path))
+    st.download_button(label, data=data, key=key,
+                       on_click=lambda: st.session_state.pop(flag, None), **kwargs)
+
+def add_version(document_id: str, version: int, file_path: str, created_by: str, note: str = "",
+                sha256: str = ""):
+    with write_conn() as conn:
+        conn.execute(SQL_INSERT_VERSION,
+                     (document_id, version, file_path, note, now_iso(), created_by))
+        conn.execute(SQL_SET_CURRENT_VERSION, (version, file_path, document_id, version))
+        if sha256:
+            # Record the stored copy only once the version that uses it commits
+            conn.execute(SQL_RECORD_UPLOAD, (sha256, file_path))
+        add_audit("version", document_id, f"v{version}", created_by, note)
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+DOCUMENT_FILTER_SQL = (
+    ("q", "rowid IN (SELECT rowid FROM documents_fts WHERE documents_fts MATCH ?)"),
+    ("department", "department=? COLLATE NOCASE"),
+    ("doc_type", "doc_type=? COLLATE NOCASE"),
+    ("sensitivity", "sensitivity=? COLLATE NOCASE"),
+    ("status", "status=? COLLATE NOCASE"),
+    ("tag", "EXISTS (SELECT 1 FROM document_tags t WHERE t.document_id=documents.id AND t.tag=?)"),
+)
+
+@functools.lru_cache(maxsize=None)
+def _document_where(keys: Tuple[str, ...]) -> str:
+    """One fixed WHERE fragment per combination of active filters"""
+    return "".join(" AND " + sql for key, sql in DOCUMENT_FILTER_SQL if key in keys)
+
+def _document_filters(filters: dict) -> Tuple[str, list]:
+    values = dict(filters, q=_fts_query(filters.get("q") or ""))
+    if (filters.get("q") or "").strip() and not values["q"]:
+        # A search with no word characters (e.g. "!!!") matches nothing rather than everything
+        return " AND 0", []
+    keys = tuple(key for key, _ in DOCUMENT_FILTER_SQL if values.get(key))
+    return _document_where(keys), [values[key] for key in keys]
+
+def list_documents(filters: dict, limit: Optional[int] = None, offset: int = 0):
+    where, args = _document_filters(filters)
+    query = "SELECT id, title, department, doc_type, sensitivity, tags, status, created_at, created_by FROM documents WHERE 1=1" + where
+    query += " ORDER BY created_at DESC, id"
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        args += [limit, offset]
+    with read_conn() as conn:
+        return conn.execute(query, args).fetchall()
+
+def count_documents(filters: dict) -> int:
+    where, args = _document_filters(filters)
+    with read_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM documents WHERE 1=1" + where, args).fetchone()[0]
+
+def list_documents_with_versions(filters: dict, limit: Optional[int] = None,
+                                 offset: int = 0) -> List[Tuple[tuple, list]]:
+    """Documents matching filters (a page of them if limit is set), each with its versions newest first"""
+    where, args = _document_filters(filters)
+    page = ""
+    if limit is not None:
+        page = " LIMIT ? OFFSET ?"
+        args += [limit, offset]
+    query = """SELECT d.id, d.title, d.department, d.doc_type, d.sensitivity, d.tags, d.status, d.created_at, d.created_by,
+                      v.version, v.file_path, v.created_at, v.created_by, v.note
+               FROM (SELECT * FROM documents WHERE 1=1""" + where + " ORDER BY created_at DESC, id" + page + """) d
+               LEFT JOIN versions v ON v.document_id = d.id
+               ORDER BY d.created_at DESC, d.id, v.version DESC"""
+    with read_conn() as conn:
+        rows = conn.execute(query, args).fetchall()
+    grouped: Dict[str, Tuple[tuple, list]] = {}
+    for row in rows:
+        doc_row, version_row = tuple(row[:9]), tuple(row[9:])
+        entry = grouped.setdefault(doc_row[0], (doc_row, []))
+        if version_row[0] is not None:
+            entry[1].append(version_row)
+    return list(grouped.values())
 
 def list_versions(document_id: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT version, file_path, created_at, created_by, note FROM versions WHERE document_id=? ORDER BY version DESC", (document_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with read_conn() as conn:
+        return conn.execute(SQL_LIST_VERSIONS, (document_id,)).fetchall()
 
 # ============================================================
 # Document Preview Functions for Approvers
 # ============================================================
 def get_file_info(file_path: str) -> dict:
-    """Get file information for preview"""
-    if not os.path.exists(file_path):
+    """Get file information for preview from a single stat call"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
         return {"error": "File not found"}
+    except OSError:
+        return {"error": "File not accessible"}
     
-    stat = os.stat(file_path)
     file_ext = os.path.splitext(file_path)[1].lower()
     mime_type, _ = mimetypes.guess_type(file_path)
     
@@ -507,15 +931,14 @@ def preview_text_file(file_path: str, file_type: str = "text"):
     except Exception as e:
         st.error(f"Cannot read text file: {str(e)}")
 
-def preview_pdf_file(file_path: str):
-    """Display PDF preview"""
-    file_size = os.path.getsize(file_path)
+def preview_pdf_file(file_path: str, file_size: Optional[int] = None):
+    """Display PDF preview; pass file_size if already known"""
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
     
     if file_size > MAX_PREVIEW_SIZE:
         st.warning(f"PDF is large ({file_size / 1024 / 1024:.1f} MB). Download to view.")
-        with open(file_path, "rb") as f:
-            st.download_button("Download PDF", data=f.read(), 
-                             file_name=os.path.basename(file_path), mime="application/pdf")
+        lazy_download_button("Download PDF", file_path, key=f"pdf_dl_{file_path}", mime="application/pdf")
         return
     
     try:
@@ -530,9 +953,7 @@ def preview_pdf_file(file_path: str):
             
     except Exception as e:
         st.error(f"PDF preview failed: {str(e)}")
-        with open(file_path, "rb") as f:
-            st.download_button("Download PDF", data=f.read(), 
-                             file_name=os.path.basename(file_path), mime="application/pdf")
+        lazy_download_button("Download PDF", file_path, key=f"pdf_dl_{file_path}", mime="application/pdf")
 
 def render_document_preview_for_approval(file_path: str, file_info: dict):
     """Render document preview optimized for approval workflow"""
@@ -550,8 +971,7 @@ def render_document_preview_for_approval(file_path: str, file_info: dict):
     # Size check
     if file_info["size"] > MAX_PREVIEW_SIZE:
         st.warning(f"File too large ({file_info['size'] / 1024 / 1024:.1f} MB) for preview")
-        with open(file_path, "rb") as f:
-            st.download_button("Download to Review", data=f.read(), 
+        lazy_download_button("Download to Review", file_path, key=f"review_dl_{file_path}",
                              file_name=file_info["name"])
         return
     
@@ -565,13 +985,12 @@ def render_document_preview_for_approval(file_path: str, file_info: dict):
     elif preview_type == "json":
         preview_text_file(file_path, "json")
     elif preview_type == "pdf":
-        preview_pdf_file(file_path)
+        preview_pdf_file(file_path, file_info["size"])
     else:
         st.info("Preview not available for this file type")
         st.write(f"MIME Type: {file_info.get('mime_type', 'Unknown')}")
         
-        with open(file_path, "rb") as f:
-            st.download_button("Download File", data=f.read(), 
+        lazy_download_button("Download File", file_path, key=f"file_dl_{file_path}",
                              file_name=file_info["name"])
 
 def create_approval_preview_interface(doc_id: str, document_title: str):
@@ -611,36 +1030,27 @@ def create_approval_preview_interface(doc_id: str, document_title: str):
         st.info(f"Version Note: {note}")
     
     # Document preview
-    if os.path.exists(file_path):
-        file_info = get_file_info(file_path)
-        if "error" not in file_info:
-            render_document_preview_for_approval(file_path, file_info)
-        else:
-            st.error("File not accessible for preview")
-    else:
+    file_info = get_file_info(file_path)
+    if "error" not in file_info:
+        render_document_preview_for_approval(file_path, file_info)
+    elif file_info["error"] == "File not found":
         st.error("Document file not found")
+    else:
+        st.error("File not accessible for preview")
         
     # Download option
-    if os.path.exists(file_path):
-        with open(file_path, "rb") as f:
-            st.download_button(
-                "Download Original File",
-                data=f.read(),
-                file_name=os.path.basename(file_path),
-                help="Download the original file for offline review"
-            )
+    if "error" not in file_info:
+        lazy_download_button("Download Original File", file_path, key=f"orig_dl_{file_path}",
+                             help="Download the original file for offline review")
 def create_custom_workflow(name: str, description: str, trigger_conditions: Dict[str, Any], created_by: str) -> str:
     """Create a new custom workflow"""
-    workflow_id = str(uuid.uuid4())
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO custom_workflows 
-        (id, name, description, trigger_conditions, created_by, created_at, active, version)
-        VALUES (?,?,?,?,?,?,1,1)""",
-        (workflow_id, name, description, json.dumps(trigger_conditions), created_by, now_iso()))
-    conn.commit()
-    conn.close()
-    add_audit("workflow", workflow_id, "create", created_by, f"Custom workflow: {name}")
+    workflow_id = uuid.uuid4().hex
+    with write_conn() as conn:
+        conn.execute("""INSERT INTO custom_workflows 
+            (id, name, description, trigger_conditions, created_by, created_at, active, version)
+            VALUES (?,?,?,?,?,?,1,1)""",
+            (workflow_id, name, description, json.dumps(trigger_conditions), created_by, now_iso()))
+        add_audit("workflow", workflow_id, "create", created_by, f"Custom workflow: {name}")
     return workflow_id
 
 def add_workflow_step(workflow_id: str, step_order: int, step_name: str, step_type: str, 
@@ -648,83 +1058,66 @@ def add_workflow_step(workflow_id: str, step_order: int, step_name: str, step_ty
                      instructions: str = "", sla_hours: int = 48, parallel_group: int = 0,
                      conditions: Dict[str, Any] = None) -> str:
     """Add a step to a custom workflow"""
-    step_id = str(uuid.uuid4())
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO workflow_steps 
-        (id, workflow_id, step_order, step_name, step_type, assignee_type, assignee_value, 
-         required, instructions, sla_hours, parallel_group, conditions)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-        (step_id, workflow_id, step_order, step_name, step_type, assignee_type, assignee_value,
-         required, instructions, sla_hours, parallel_group, json.dumps(conditions or {})))
-    conn.commit()
-    conn.close()
+    step_id = uuid.uuid4().hex
+    with write_conn() as conn:
+        conn.execute("""INSERT INTO workflow_steps 
+            (id, workflow_id, step_order, step_name, step_type, assignee_type, assignee_value, 
+             required, instructions, sla_hours, parallel_group, conditions)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
+            (step_id, workflow_id, step_order, step_name, step_type, assignee_type, assignee_value,
+             required, instructions, sla_hours, parallel_group, json.dumps(conditions or {})))
     return step_id
 
 def get_custom_workflows() -> List[Dict[str, Any]]:
     """Get all custom workflows"""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT id, name, description, trigger_conditions, created_by, created_at, active
-                   FROM custom_workflows WHERE active=1 ORDER BY name""")
-    rows = cur.fetchall()
-    conn.close()
-    
-    workflows = []
-    for row in rows:
-        workflows.append({
-            "id": row[0], "name": row[1], "description": row[2],
-            "trigger_conditions": json.loads(row[3]) if row[3] else {},
-            "created_by": row[4], "created_at": row[5], "active": row[6]
-        })
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        workflows = [dict(row) for row in cur.execute(
+            """SELECT id, name, description, trigger_conditions, created_by, created_at, active
+               FROM custom_workflows WHERE active=1 ORDER BY name""")]
+    for workflow in workflows:
+        workflow["trigger_conditions"] = json.loads(workflow["trigger_conditions"] or "{}")
     return workflows
 
 def get_workflow_steps(workflow_id: str) -> List[Dict[str, Any]]:
     """Get steps for a workflow"""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT id, step_order, step_name, step_type, assignee_type, assignee_value,
-                          required, instructions, sla_hours, parallel_group, conditions
-                   FROM workflow_steps WHERE workflow_id=? ORDER BY step_order""", (workflow_id,))
-    rows = cur.fetchall()
-    conn.close()
-    
-    steps = []
-    for row in rows:
-        steps.append({
-            "id": row[0], "step_order": row[1], "step_name": row[2], "step_type": row[3],
-            "assignee_type": row[4], "assignee_value": row[5], "required": row[6],
-            "instructions": row[7], "sla_hours": row[8], "parallel_group": row[9],
-            "conditions": json.loads(row[10]) if row[10] else {}
-        })
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        steps = [dict(row) for row in cur.execute(
+            """SELECT id, step_order, step_name, step_type, assignee_type, assignee_value,
+                      required, instructions, sla_hours, parallel_group, conditions
+               FROM workflow_steps WHERE workflow_id=? ORDER BY step_order""", (workflow_id,))]
+    for step in steps:
+        step["conditions"] = json.loads(step["conditions"] or "{}")
     return steps
 
 def start_custom_workflow(document_id: str, workflow_id: str) -> str:
     """Start a custom workflow for a document"""
-    instance_id = str(uuid.uuid4())
-    conn = connect()
-    cur = conn.cursor()
+    instance_id = uuid.uuid4().hex
     
-    # Create workflow instance
-    cur.execute("""INSERT INTO workflow_instances 
-        (id, document_id, workflow_id, current_step, status, started_at)
-        VALUES (?,?,?,1,'active',?)""",
-        (instance_id, document_id, workflow_id, now_iso()))
-    
-    # Create step executions for all steps
-    steps = get_workflow_steps(workflow_id)
-    for step in steps:
+    # Resolve step executions for all steps before taking the write lock
+    executions = []
+    for step in get_workflow_steps(workflow_id):
         # Determine assignee
         assignee = resolve_assignee(step["assignee_type"], step["assignee_value"], document_id)
         if assignee:
             status = "pending" if step["step_order"] == 1 else "waiting"
-            cur.execute("""INSERT INTO step_executions 
-                (id, workflow_instance_id, step_id, assigned_to, status)
-                VALUES (?,?,?,?,?)""",
-                (str(uuid.uuid4()), instance_id, step["id"], assignee, status))
+            executions.append((uuid.uuid4().hex, instance_id, step["id"], assignee, status))
     
-    conn.commit()
-    conn.close()
+    with write_conn() as conn:
+        cur = conn.cursor()
+        
+        # Create workflow instance
+        cur.execute("""INSERT INTO workflow_instances 
+            (id, document_id, workflow_id, current_step, status, started_at)
+            VALUES (?,?,?,1,'active',?)""",
+            (instance_id, document_id, workflow_id, now_iso()))
+        
+        cur.executemany("""INSERT INTO step_executions 
+            (id, workflow_instance_id, step_id, assigned_to, status)
+            VALUES (?,?,?,?,?)""", executions)
     return instance_id
 
 def resolve_assignee(assignee_type: str, assignee_value: str, document_id: str) -> Optional[str]:
@@ -735,16 +1128,13 @@ def resolve_assignee(assignee_type: str, assignee_value: str, document_id: str)
         return user[0] if user else None
     elif assignee_type == "role":
         # Find first user with this role
-        users = get_users()
-        for user in users:
-            if user[2] == assignee_value:
-                return user[0]
+        user = get_user_by_role(assignee_value)
+        return user[0] if user else None
     elif assignee_type == "department":
-        # Find department manager or lead
-        users = get_users()
-        for user in users:
-            if "Manager" in user[2] or "Lead" in user[2]:
-                return user[0]
+        # Find department manager or lead: the first role group that holds one
+        for role, holders in get_users_by_role().items():
+            if "Manager" in role or "Lead" in role:
+                return holders[0][0]
     elif assignee_type == "dynamic":
         # Dynamic assignment based on document properties
         # Could implement various rules here
@@ -783,252 +1173,316 @@ def check_workflow_triggers(document: Dict[str, Any]) -> List[str]:
 
 def get_workflow_instance_status(document_id: str) -> Optional[Dict[str, Any]]:
     """Get the current workflow status for a document"""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT wi.id, wi.workflow_id, wi.current_step, wi.status, wi.started_at,
-                          cw.name as workflow_name
-                   FROM workflow_instances wi
-                   JOIN custom_workflows cw ON wi.workflow_id = cw.id
-                   WHERE wi.document_id=? AND wi.status='active'""", (document_id,))
-    row = cur.fetchone()
-    conn.close()
-    
-    if not row:
-        return None
-    
-    return {
-        "instance_id": row[0], "workflow_id": row[1], "current_step": row[2],
-        "status": row[3], "started_at": row[4], "workflow_name": row[5]
-    }
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        row = cur.execute("""SELECT wi.id AS instance_id, wi.workflow_id, wi.current_step, wi.status, wi.started_at,
+                                    cw.name as workflow_name
+                             FROM workflow_instances wi
+                             JOIN custom_workflows cw ON wi.workflow_id = cw.id
+                             WHERE wi.document_id=? AND wi.status='active'""", (document_id,)).fetchone()
+    return dict(row) if row else None
 
 def complete_workflow_step(instance_id: str, step_id: str, result: str, comments: str, user_id: str):
     """Complete a workflow step"""
-    conn = connect()
-    cur = conn.cursor()
-    
-    # Update step execution
-    cur.execute("""UPDATE step_executions 
-                   SET status='completed', completed_at=?, result=?, comments=?
-                   WHERE workflow_instance_id=? AND step_id=? AND assigned_to=?""",
-                (now_iso(), result, comments, instance_id, step_id, user_id))
-    
-    # Check if we should advance workflow
-    cur.execute("""SELECT COUNT(*) FROM step_executions se
-                   JOIN workflow_steps ws ON se.step_id = ws.id
-                   WHERE se.workflow_instance_id=? AND ws.required=1 AND se.status != 'completed'""",
-                (instance_id,))
-    
-    remaining_required = cur.fetchone()[0]
+    with write_conn() as conn:
+        cur = conn.cursor()
     
-    if remaining_required == 0:
-        # Workflow complete
-        cur.execute("""UPDATE workflow_instances 
-                       SET status='completed', completed_at=? WHERE id=?""",
-                    (now_iso(), instance_id))
+        # Update step execution
+        cur.execute("""UPDATE step_executions 
+                       SET status='completed', completed_at=?, result=?, comments=?
+                       WHERE workflow_instance_id=? AND step_id=? AND assigned_to=?""",
+                    (now_iso(), result, comments, instance_id, step_id, user_id))
+    
+        # Check if we should advance workflow
+        cur.execute("""SELECT 1 FROM step_executions se
+                       JOIN workflow_steps ws ON se.step_id = ws.id
+                       WHERE se.workflow_instance_id=? AND ws.required=1 AND se.status != 'completed'
+                       LIMIT 1""",
+                    (instance_id,))
+    
+        if cur.fetchone() is None:
+            # Workflow complete
+            cur.execute("""UPDATE workflow_instances 
+                           SET status='completed', completed_at=? WHERE id=?""",
+                        (now_iso(), instance_id))
         
-        # Update document status
-        cur.execute("""SELECT document_id FROM workflow_instances WHERE id=?""", (instance_id,))
-        doc_id = cur.fetchone()[0]
-        if result == "approved":
-            cur.execute("UPDATE documents SET status='Approved' WHERE id=?", (doc_id,))
-        elif result == "rejected":
-            cur.execute("UPDATE documents SET status='Rejected' WHERE id=?", (doc_id,))
+            # Update document status
+            cur.execute("""SELECT document_id FROM workflow_instances WHERE id=?""", (instance_id,))
+            doc_id = cur.fetchone()[0]
+            if result == "approved":
+                cur.execute("UPDATE documents SET status='Approved' WHERE id=?", (doc_id,))
+            elif result == "rejected":
+                cur.execute("UPDATE documents SET status='Rejected' WHERE id=?", (doc_id,))
     
-    conn.commit()
-    conn.close()
 
 def add_document_annotation(document_id: str, version: int, author: str, 
                           annotation_type: str, content: str, position_data: Dict[str, Any] = None):
     """Add an annotation to a document"""
-    annotation_id = str(uuid.uuid4())
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO document_annotations 
-        (id, document_id, version, author, annotation_type, content, position_data, created_at)
-        VALUES (?,?,?,?,?,?,?,?)""",
-        (annotation_id, document_id, version, author, annotation_type, content,
-         json.dumps(position_data or {}), now_iso()))
-    conn.commit()
-    conn.close()
+    annotation_id = uuid.uuid4().hex
+    with write_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_INSERT_ANNOTATION,
+            (annotation_id, document_id, version, author, annotation_type, content,
+             json.dumps(position_data or {}), now_iso()))
     return annotation_id
 
 def get_document_annotations(document_id: str, version: int = None) -> List[Dict[str, Any]]:
     """Get annotations for a document"""
-    conn = connect()
-    cur = conn.cursor()
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
     
-    if version:
-        cur.execute("""SELECT id, version, author, annotation_type, content, position_data, created_at
-                       FROM document_annotations 
-                       WHERE document_id=? AND version=? ORDER BY created_at""", 
-                    (document_id, version))
-    else:
-        cur.execute("""SELECT id, version, author, annotation_type, content, position_data, created_at
-                       FROM document_annotations 
-                       WHERE document_id=? ORDER BY version DESC, created_at""", 
-                    (document_id,))
+        if version:
+            cur.execute("""SELECT id, version, author, annotation_type, content, position_data, created_at
+                           FROM document_annotations 
+                           WHERE document_id=? AND version=? ORDER BY created_at""", 
+                        (document_id, version))
+        else:
+            cur.execute("""SELECT id, version, author, annotation_type, content, position_data, created_at
+                           FROM document_annotations 
+                           WHERE document_id=? ORDER BY version DESC, created_at""", 
+                        (document_id,))
     
-    rows = cur.fetchall()
-    conn.close()
+        annotations = [dict(row) for row in cur.fetchall()]
     
-    annotations = []
-    for row in rows:
-        annotations.append({
-            "id": row[0], "version": row[1], "author": row[2], "annotation_type": row[3],
-            "content": row[4], "position_data": json.loads(row[5]) if row[5] else {},
-            "created_at": row[6]
-        })
+    for annotation in annotations:
+        annotation["position_data"] = json.loads(annotation["position_data"] or "{}")
     return annotations
 def create_sequential_approvals(document_id: str, workflow_type: str, created_by: str):
-    if workflow_type not in APPROVAL_WORKFLOWS:
+    workflow = APPROVAL_WORKFLOWS.get(workflow_type)
+    if workflow is None:
         return False
     
-    workflow = APPROVAL_WORKFLOWS[workflow_type]
-    conn = connect()
-    cur = conn.cursor()
-    
-    # Clear any existing approvals for this document
-    cur.execute("DELETE FROM approvals WHERE document_id=?", (document_id,))
+    by_name = get_users_by_name_map()
+    by_role = get_users_by_role()
+    created_at = now_iso()
     
     # Create approval steps - first one pending, rest queued
+    rows = []
     for i, role_name in enumerate(workflow["steps"]):
-        # Find user with this role
-        user = get_user_by_name(role_name)
-        if not user:
-            # Fallback: find any user with this role
-            users = get_users()
-            matching_users = [u for u in users if u[2] == role_name]
-            if matching_users:
-                user = matching_users[0]
+        # Find user with this role: a user named after it first, else any user holding it
+        user = by_name.get(role_name) or (by_role.get(role_name) or [None])[0]
         
         if user:
             status = "pending" if i == 0 else "queued"
-            cur.execute("""INSERT INTO approvals
-                (id, document_id, assigned_to, status, comment, created_at, decided_at)
-                VALUES (?,?,?,?,?,?,?)""",
-                (str(uuid.uuid4()), document_id, user[0], status, "", now_iso(), ""))
-    
-    conn.commit()
-    conn.close()
-    add_audit("workflow", document_id, "create", created_by, f"Workflow: {workflow_type}")
+            rows.append((document_id, user[0], status, "", created_at, ""))
+    
+    with write_conn() as conn:
+        # Clear any existing approvals for this document
+        conn.execute("DELETE FROM approvals WHERE document_id=?", (document_id,))
+        conn.executemany(SQL_INSERT_APPROVAL, rows)
+        add_audit("workflow", document_id, "create", created_by, f"Workflow: {workflow_type}")
+        get_pool().after_commit(count_pending_approvals.clear)
     return True
 
-def get_document_approvals(document_id: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT a.id, a.assigned_to, a.status, a.comment, a.created_at, a.decided_at,
-                          u.name, u.role
-                   FROM approvals a 
-                   JOIN users u ON a.assigned_to = u.id
-                   WHERE a.document_id=? 
-                   ORDER BY a.created_at""", (document_id,))
-    rows = cur.fetchall()
-    conn.close()
-    
-    approvals = []
-    for row in rows:
-        approvals.append({
-            "id": row[0], "assigned_to": row[1], "status": row[2], "comment": row[3],
-            "created_at": row[4], "decided_at": row[5], "user_name": row[6], "user_role": row[7]
-        })
-    return approvals
+def create_document_with_workflow(title, department, doc_type, sensitivity, tags: List[str],
+                                  retention_policy, retention_years: int, created_by,
+                                  file, version_note: str, workflow_type: str,
+                                  effective_date: Optional[Union[str, dt.date]] = None,
+                                  expiry_date: Optional[Union[str, dt.date]] = None,
+                                  description: str = "") -> Tuple[str, bool]:
+    """Create a document, its first version and its approval chain in one transaction"""
+    # The upload is written before the transaction so the write lock isn't held during file I/O
+    doc_id = uuid.uuid4().hex
+    path, sha256 = save_upload(file, doc_id, 1)
+    try:
+        with write_conn():
+            create_document_record(title, department, doc_type, sensitivity, tags,
+                                   retention_policy, retention_years, created_by,
+                                   status="Review", effective_date=effective_date,
+                                   expiry_date=expiry_date, description=description,
+                                   workflow_type=workflow_type, doc_id=doc_id)
+            add_version(doc_id, 1, path, created_by, version_note, sha256=sha256)
+            started = create_sequential_approvals(doc_id, workflow_type, created_by)
+    except Exception:
+        # Don't leave an orphaned upload behind when the transaction rolls back
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return doc_id, started
+
+def get_document_approvals(document_id: str) -> List[sqlite3.Row]:
+    """Approvals in chain order; rows are read by column name, not copied into dicts"""
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        return cur.execute(SQL_DOCUMENT_APPROVALS, (document_id,)).fetchall()
+
+def get_approval_progress(document_ids: List[str]) -> Dict[str, str]:
+    """One rendered 'name → name' progress line per document; step labels are built in SQL"""
+    if not document_ids:
+        return {}
+    placeholders = ",".join("?" * len(document_ids))
+    with read_conn() as conn:
+        rows = conn.execute(f"""SELECT a.document_id,
+                                       CASE a.status WHEN 'approved' THEN '✅ ' || u.name
+                                                     WHEN 'rejected' THEN '❌ ' || u.name
+                                                     WHEN 'pending' THEN '⏳ ' || u.name || ' (YOU)'
+                                                     ELSE '⏸️ ' || u.name END
+                                FROM approvals a
+                                JOIN users u ON a.assigned_to = u.id
+                                WHERE a.document_id IN ({placeholders})
+                                ORDER BY a.document_id, a.created_at, a.id""", document_ids).fetchall()
+    # Joined here rather than with GROUP_CONCAT, whose order SQLite leaves undefined
+    steps: Dict[str, List[str]] = {}
+    for document_id, step in rows:
+        steps.setdefault(document_id, []).append(step)
+    return {document_id: " → ".join(chain) for document_id, chain in steps.items()}
+
+@st.cache_data(ttl=PENDING_COUNT_TTL, max_entries=1024)
+def count_pending_approvals(user_id: str) -> int:
+    """Pending approvals for the sidebar badge; cleared after every approval commit, the TTL covers other processes"""
+    with read_conn() as conn:
+        return conn.execute(SQL_PENDING_COUNT, (user_id,)).fetchone()[0]
 
 def assign_approval(document_id: str, approver_id: str, status: str = "pending"):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO approvals
-        (id, document_id, assigned_to, status, comment, created_at, decided_at)
-        VALUES (?,?,?,?,?, ?, '')""",
-        (str(uuid.uuid4()), document_id, approver_id, status, "", now_iso()))
-    conn.commit()
-    conn.close()
-    add_audit("approval", document_id, status, approver_id, "")
+    with write_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_INSERT_APPROVAL,
+            (document_id, approver_id, status, "", now_iso(), ""))
+        add_audit("approval", document_id, status, approver_id, "")
+        get_pool().after_commit(count_pending_approvals.clear)
+
+def assign_approvals_bulk(document_id: str, approver_ids: List[str], statuses: List[str]):
+    """Assign several approvers to a document with a single executemany"""
+    created_at = now_iso()
+    rows = [(document_id, approver_id, status, "", created_at, "")
+            for approver_id, status in zip(approver_ids, statuses)]
+    with write_conn() as conn:
+        conn.executemany(SQL_INSERT_APPROVAL, rows)
+        add_audit_bulk([("approval", document_id, status, approver_id, "")
+                        for approver_id, status in zip(approver_ids, statuses)])
+        get_pool().after_commit(count_pending_approvals.clear)
 
 def decide_approval(document_id: str, approver_id: str, decision: str, comment: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""UPDATE approvals
-       SET status=?, comment=?, decided_at=?
-       WHERE document_id=? AND assigned_to=? AND status='pending'""",
-       (decision, comment, now_iso(), document_id, approver_id))
-    
-    # If approved, promote next queued approver
-    if decision == "approved":
-        cur.execute("SELECT id FROM approvals WHERE document_id=? AND status='queued' ORDER BY created_at ASC LIMIT 1", (document_id,))
-        nxt = cur.fetchone()
-        if nxt:
-            cur.execute("UPDATE approvals SET status='pending' WHERE id=?", (nxt[0],))
-        else:
-            # All approvals complete
-            cur.execute("UPDATE documents SET status='Approved' WHERE id=?", (document_id,))
-    elif decision == "rejected":
-        # Mark document as rejected
-        cur.execute("UPDATE documents SET status='Rejected' WHERE id=?", (document_id,))
-        cur.execute("UPDATE approvals SET status='skipped' WHERE document_id=? AND status='queued'", (document_id,))
-    
-    conn.commit()
-    conn.close()
-    add_audit("approval", document_id, decision, approver_id, comment)
+    with write_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""UPDATE approvals
+           SET status=?, comment=?, decided_at=?
+           WHERE document_id=? AND assigned_to=? AND status='pending'""",
+           (decision, comment, now_iso(), document_id, approver_id))
+    
+        # If approved, promote next queued approver
+        if decision == "approved":
+            cur.execute("""UPDATE approvals SET status='pending'
+                           WHERE id = (SELECT id FROM approvals WHERE document_id=? AND status='queued'
+                                       ORDER BY created_at ASC, id ASC LIMIT 1)""", (document_id,))
+            if cur.rowcount == 0:
+                # All approvals complete
+                cur.execute("UPDATE documents SET status='Approved' WHERE id=?", (document_id,))
+        elif decision == "rejected":
+            # Mark document as rejected
+            cur.execute("UPDATE documents SET status='Rejected' WHERE id=?", (document_id,))
+            cur.execute("UPDATE approvals SET status='skipped' WHERE document_id=? AND status='queued'", (document_id,))
+    
+        add_audit("approval", document_id, decision, approver_id, comment)
+        get_pool().after_commit(count_pending_approvals.clear)
 
 # ============================================================
 # E-Signatures
 # ============================================================
-def add_signature_image(text: str) -> Image.Image:
-    img = Image.new("RGB", (600, 200), "white")
+BLANK_SIGNATURE = Image.new("1", (600, 200), 1)  # 1-bit canvas: typed signatures are black on white
+SIGNATURE_FONT = ImageFont.load_default()
+
+@functools.lru_cache(maxsize=256)
+def add_signature_image(text: str) -> bytes:
+    """PNG bytes of a typed signature; identical text reuses the rendered image"""
+    img = BLANK_SIGNATURE.copy()
     draw = ImageDraw.Draw(img)
-    draw.text((20, 80), text, fill="black")
-    return img
+    draw.text((20, 80), text, fill=0, font=SIGNATURE_FONT)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
 
-def save_signature(document_id: str, signer_id: str, method: str, image: Optional[Image.Image] = None):
+def save_signature(document_id: str, signer_id: str, method: str, image: Optional[bytes] = None):
     path = None
     if image is not None:
         path = os.path.join(FILES_DIR, f"sig_{document_id}_{uuid.uuid4().hex}.png")
-        image.save(path)
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO signatures
-        (id, document_id, signer, method, image_path, signed_at)
-        VALUES (?,?,?,?,?,?)""",
-        (str(uuid.uuid4()), document_id, signer_id, method, path, now_iso()))
-    conn.commit()
-    conn.close()
-    add_audit("signature", document_id, method, signer_id, path or "")
+        with open(path, "wb") as f:
+            f.write(image)
+    with write_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_INSERT_SIGNATURE,
+            (document_id, signer_id, method, path, now_iso()))
+        add_audit("signature", document_id, method, signer_id, path or "")
 
 # ============================================================
 # Tickets
 # ============================================================
 def create_ticket(requester_id: str, process_type: str, linked_document_id: str, notes: str,
                   priority: str = "Normal", sla_hours: int = 48, assigned_to: str = "") -> str:
-    tid = str(uuid.uuid4())
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO tickets
-        (id, requester, process_type, linked_document_id, status, priority, sla_hours, notes, assigned_to, created_at, closed_at)
-        VALUES (?,?,?,?, 'Open', ?, ?, ?, ?, ?, '')""",
-        (tid, requester_id, process_type, linked_document_id, priority, sla_hours, notes, assigned_to, now_iso()))
-    conn.commit()
-    conn.close()
-    add_audit("ticket", tid, "create", requester_id, f"{process_type} -> {linked_document_id}")
+    tid = uuid.uuid4().hex
+    with write_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(SQL_INSERT_TICKET,
+            (tid, requester_id, process_type, linked_document_id, priority, sla_hours, notes, assigned_to, now_iso()))
+        add_audit("ticket", tid, "create", requester_id, f"{process_type} -> {linked_document_id}")
     return tid
 
-def list_my_tickets(user_id: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT id, process_type, status, priority, sla_hours, notes, linked_document_id, created_at
-                   FROM tickets
-                   WHERE requester=? OR assigned_to=?
-                   ORDER BY created_at DESC""", (user_id, user_id))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+SQL_MY_TICKETS = """SELECT id, process_type, status, priority, sla_hours, notes, linked_document_id, created_at
+    FROM tickets
+    WHERE requester=? OR assigned_to=?
+    ORDER BY created_at DESC"""
+SQL_MY_PENDING_APPROVALS = """SELECT a.document_id, d.title, d.doc_type, d.department, d.sensitivity,
+           a.status, a.comment, a.created_at, d.created_by, u.name as creator_name,
+           d.current_version, d.latest_path
+    FROM approvals a 
+    JOIN documents d ON a.document_id = d.id
+    JOIN users u ON d.created_by = u.id
+    WHERE a.assigned_to=? AND a.status='pending'
+    ORDER BY a.created_at ASC"""
+SQL_MY_DECIDED_APPROVALS = """SELECT a.document_id, d.title, a.status, a.decided_at, a.comment
+    FROM approvals a 
+    JOIN documents d ON a.document_id = d.id
+    WHERE a.assigned_to=? AND a.status IN ('approved', 'rejected')
+    ORDER BY a.decided_at DESC LIMIT 10"""
+
+def list_my_approvals(user_id: str, conn: Optional[sqlite3.Connection] = None) -> Tuple[list, list]:
+    """(pending, recently decided) approvals assigned to user_id; runs on conn when given"""
+    if conn is None:
+        with read_conn() as conn:
+            return list_my_approvals(user_id, conn)
+    return (conn.execute(SQL_MY_PENDING_APPROVALS, (user_id,)).fetchall(),
+            conn.execute(SQL_MY_DECIDED_APPROVALS, (user_id,)).fetchall())
+
+def list_my_tasks(user_id: str) -> Tuple[list, Tuple[list, list]]:
+    """Tickets plus list_my_approvals() for user_id, read on one connection"""
+    with read_conn() as conn:
+        return (conn.execute(SQL_MY_TICKETS, (user_id, user_id)).fetchall(),
+                list_my_approvals(user_id, conn))
 
 def close_ticket(ticket_id: str, user_id: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("UPDATE tickets SET status='Closed', closed_at=? WHERE id=?", (now_iso(), ticket_id))
-    conn.commit()
-    conn.close()
-    add_audit("ticket", ticket_id, "close", user_id, "")
+    with write_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE tickets SET status='Closed', closed_at=? WHERE id=?", (now_iso(), ticket_id))
+        add_audit("ticket", ticket_id, "close", user_id, "")
+
+def submit_request(requester_id: str, process: str, title: str, department: str, doc_type: str,
+                   sensitivity: str, tags: List[str], retention_policy: str, retention_years: int,
+                   file, notes: str, priority: str, sla_hours: int) -> Tuple[str, str]:
+    """Create the document, first version, ticket and approval chain in one transaction"""
+    # The upload is written before the transaction so the write lock isn't held during file I/O
+    doc_id = uuid.uuid4().hex
+    path, sha256 = save_upload(file, doc_id, 1)
+    try:
+        with write_conn():
+            create_document_record(title, department, doc_type, sensitivity, tags,
+                                   retention_policy, retention_years,
+                                   requester_id, status="Review", description=notes, doc_id=doc_id)
+            add_version(doc_id, 1, path, requester_id, f"Request init: {notes[:200]}", sha256=sha256)
+
+            assignees = get_process_assignees()[process]
+            first_assignee = assignees[0] if assignees else ""
+            tid = create_ticket(requester_id, process, doc_id, notes, priority, sla_hours, first_assignee)
+            assign_approvals_bulk(doc_id, assignees,
+                                  ["pending" if idx == 0 else "queued" for idx in range(len(assignees))])
+    except Exception:
+        # Don't leave an orphaned upload behind when the transaction rolls back
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return tid, doc_id
 
 # ============================================================
 # UI PAGES - Enhanced with Workflow Builder
@@ -1086,9 +1540,7 @@ def page_workflow_builder(current_user):
                                           "Engineering Lead", "QA Reviewer", "Approver"]
                         assignee_value = st.selectbox("Role", assignee_options)
                     elif assignee_type == "user":
-                        users = get_users()
-                        user_options = [u[1] for u in users]
-                        assignee_value = st.selectbox("User", user_options)
+                        assignee_value = st.selectbox("User", list(get_users_by_name_map()))
                     else:
                         assignee_value = st.selectbox("Department", DEPARTMENTS)
                 
@@ -1160,26 +1612,28 @@ def page_workflow_builder(current_user):
                     "sensitivity": trigger_sensitivity
                 }
                 
-                workflow_id = create_custom_workflow(workflow_name, description, trigger_conditions, current_user[0])
+                # Workflow, its steps and the audit row commit as one transaction
+                with write_conn():
+                    workflow_id = create_custom_workflow(workflow_name, description, trigger_conditions, current_user[0])
                 
-                # Add steps
-                for i, step in enumerate(st.session_state.workflow_steps):
-                    add_workflow_step(
-                        workflow_id=workflow_id,
-                        step_order=i + 1,
-                        step_name=step["step_name"],
-                        step_type=step["step_type"],
-                        assignee_type=step["assignee_type"],
-                        assignee_value=step["assignee_value"],
-                        required=step["required"],
-                        instructions=step["instructions"],
-                        sla_hours=step["sla_hours"],
-                        parallel_group=step["parallel_group"]
-                    )
+                    # Add steps
+                    for i, step in enumerate(st.session_state.workflow_steps):
+                        add_workflow_step(
+                            workflow_id=workflow_id,
+                            step_order=i + 1,
+                            step_name=step["step_name"],
+                            step_type=step["step_type"],
+                            assignee_type=step["assignee_type"],
+                            assignee_value=step["assignee_value"],
+                            required=step["required"],
+                            instructions=step["instructions"],
+                            sla_hours=step["sla_hours"],
+                            parallel_group=step["parallel_group"]
+                        )
+                    add_audit("workflow", workflow_id, "create", current_user[0], f"Created workflow: {workflow_name}")
                 
                 st.success(f"Workflow '{workflow_name}' created successfully!")
                 st.session_state.workflow_steps = []  # Clear the form
-                add_audit("workflow", workflow_id, "create", current_user[0], f"Created workflow: {workflow_name}")
                 st.rerun()
     
     with tab2:
@@ -1245,19 +1699,18 @@ def page_workflow_builder(current_user):
         st.markdown("### Workflow Analytics")
         
         # Get workflow usage stats
-        conn = connect()
-        cur = conn.cursor()
+        with read_conn() as conn:
+            cur = conn.cursor()
         
-        # Workflow execution counts
-        cur.execute("""SELECT cw.name, COUNT(wi.id) as executions
-                       FROM custom_workflows cw
-                       LEFT JOIN workflow_instances wi ON cw.id = wi.workflow_id
-                       WHERE cw.active = 1
-                       GROUP BY cw.id, cw.name
-                       ORDER BY executions DESC""")
+            # Workflow execution counts
+            cur.execute("""SELECT cw.name, COUNT(wi.id) as executions
+                           FROM custom_workflows cw
+                           LEFT JOIN workflow_instances wi ON cw.id = wi.workflow_id
+                           WHERE cw.active = 1
+                           GROUP BY cw.id, cw.name
+                           ORDER BY executions DESC""")
         
-        workflow_stats = cur.fetchall()
-        conn.close()
+            workflow_stats = cur.fetchall()
         
         if workflow_stats:
             st.markdown("#### Workflow Usage")
@@ -1287,23 +1740,20 @@ def page_enhanced_document_viewer(current_user):
     # Store selected doc ID
     st.session_state.selected_doc_id = doc_id
     
-    # Get document details
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""SELECT id, title, department, doc_type, sensitivity, tags, status, 
-                          created_at, created_by FROM documents WHERE id=? AND active=1""", (doc_id,))
-    doc_row = cur.fetchone()
-    conn.close()
+    # Get document details and, on the same snapshot, the versions every tab shares
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = sqlite3.Row
+        cur.execute("""SELECT id, title, department, doc_type, sensitivity, tags, status, 
+                              created_at, created_by FROM documents WHERE id=? AND active=1""", (doc_id,))
+        doc_row = cur.fetchone()
+        versions = conn.execute(SQL_LIST_VERSIONS, (doc_id,)).fetchall() if doc_row else []
     
     if not doc_row:
         st.error("❌ Document not found.")
         return
     
-    doc = {
-        "id": doc_row[0], "title": doc_row[1], "department": doc_row[2], 
-        "doc_type": doc_row[3], "sensitivity": doc_row[4], "tags": doc_row[5],
-        "status": doc_row[6], "created_at": doc_row[7], "created_by": doc_row[8]
-    }
+    doc = dict(doc_row)
     
     # Document header
     col1, col2, col3 = st.columns([2, 1, 1])
@@ -1311,8 +1761,7 @@ def page_enhanced_document_viewer(current_user):
         st.markdown(f"## {doc['title']}")
         st.write(f"**Department:** {doc['department']} • **Type:** {doc['doc_type']}")
     with col2:
-        status_colors = {"Draft": "🟡", "Review": "🔵", "Approved": "🟢", "Rejected": "🔴"}
-        status_icon = status_colors.get(doc['status'], '⚫')
+        status_icon = STATUS_ICONS.get(doc['status'], '⚫')
         st.markdown(f"### {status_icon} {doc['status']}")
     with col3:
         st.write(f"**Created:** {doc['created_at'][:10]}")
@@ -1323,8 +1772,6 @@ def page_enhanced_document_viewer(current_user):
     
     with tab1:
         # Document versions
-        versions = list_versions(doc_id)
-        
         if not versions:
             st.warning("No versions found for this document.")
         else:
@@ -1344,10 +1791,7 @@ def page_enhanced_document_viewer(current_user):
                 if note:
                     st.write(f"**Note:** {note}")
             with col3:
-                if os.path.exists(file_path):
-                    with open(file_path, "rb") as f:
-                        st.download_button("📥 Download", data=f.read(), 
-                                         file_name=os.path.basename(file_path))
+                lazy_download_button("📥 Download", file_path, key=f"viewer_dl_{file_path}")
                 
                 # Simple file preview placeholder
                 st.info("📄 Document preview would be displayed here")
@@ -1363,17 +1807,16 @@ def page_enhanced_document_viewer(current_user):
             st.write(f"**Current Step:** {workflow_status['current_step']}")
             
             # Get current step executions
-            conn = connect()
-            cur = conn.cursor()
-            cur.execute("""SELECT se.id, ws.step_name, ws.step_type, se.assigned_to, se.status, 
-                                  se.started_at, se.result, se.comments, u.name
-                           FROM step_executions se
-                           JOIN workflow_steps ws ON se.step_id = ws.id
-                           JOIN users u ON se.assigned_to = u.id
-                           WHERE se.workflow_instance_id = ?
-                           ORDER BY ws.step_order""", (workflow_status['instance_id'],))
-            step_executions = cur.fetchall()
-            conn.close()
+            with read_conn() as conn:
+                cur = conn.cursor()
+                cur.execute("""SELECT se.id, ws.step_name, ws.step_type, se.assigned_to, se.status, 
+                                      se.started_at, se.result, se.comments, u.name
+                               FROM step_executions se
+                               JOIN workflow_steps ws ON se.step_id = ws.id
+                               JOIN users u ON se.assigned_to = u.id
+                               WHERE se.workflow_instance_id = ?
+                               ORDER BY ws.step_order""", (workflow_status['instance_id'],))
+                step_executions = cur.fetchall()
             
             if step_executions:
                 st.markdown("#### Workflow Progress")
@@ -1475,7 +1918,6 @@ def page_enhanced_document_viewer(current_user):
         # Document annotations
         st.markdown("### 📝 Document Annotations")
         
-        versions = list_versions(doc_id)
         if versions:
             version_for_annotations = st.selectbox("View annotations for version:", 
                                                    [v[0] for v in versions],
@@ -1502,7 +1944,6 @@ def page_enhanced_document_viewer(current_user):
         # Add annotations
         st.markdown("### ✍️ Add Notes & Annotations")
         
-        versions = list_versions(doc_id)
         if versions:
             target_version = st.selectbox("Add annotation to version:", 
                                         [v[0] for v in versions],
@@ -1552,9 +1993,7 @@ def page_create_document_enhanced(current_user):
         if workflow_type:
             workflow = APPROVAL_WORKFLOWS[workflow_type]
             st.info(f"**{workflow['description']}**")
-            st.write("Approval steps:")
-            for i, step in enumerate(workflow['steps'], 1):
-                st.write(f"  {i}. {step}")
+            st.markdown(WORKFLOW_STEP_PREVIEWS[workflow_type])
         
         st.markdown("### File Upload")
         uploaded_file = st.file_uploader("Select document file *")
@@ -1575,7 +2014,7 @@ def page_create_document_enhanced(current_user):
             return
         
         tag_list = [t.strip() for t in tags.split(",") if t.strip()]
-        doc_id = create_document_record(
+        doc_id, workflow_started = create_document_with_workflow(
             title=title,
             department=department,
             doc_type=doc_type,
@@ -1584,18 +2023,15 @@ def page_create_document_enhanced(current_user):
             retention_policy=retention_policy,
             retention_years=int(retention_years or 0),
             created_by=current_user[0],
-            status="Review",
-            effective_date=effective_date.isoformat() if effective_date else None,
-            expiry_date=expiry_date.isoformat() if expiry_date else None,
-            description=description,
-            workflow_type=workflow_type
+            file=uploaded_file,
+            version_note=version_note,
+            workflow_type=workflow_type,
+            effective_date=effective_date,
+            expiry_date=expiry_date,
+            description=description
         )
         
-        version = next_version(doc_id)
-        file_path = save_upload(uploaded_file, doc_id, version)
-        add_version(doc_id, version, file_path, current_user[0], version_note)
-        
-        if create_sequential_approvals(doc_id, workflow_type, current_user[0]):
+        if workflow_started:
             st.success(f"Document created successfully!")
             st.info(f"Document ID: `{doc_id}`")
             st.info(f"Approval workflow '{workflow_type}' has been initiated")
@@ -1609,35 +2045,20 @@ def page_create_document_enhanced(current_user):
         else:
             st.error("Failed to create approval workflow.")
 
-def page_my_approvals_enhanced(current_user):
+def page_my_approvals_enhanced(current_user, approvals: Optional[Tuple[list, list]] = None):
     st.subheader("My Pending Approvals")
     
-    conn = connect()
-    cur = conn.cursor()
-    
-    cur.execute("""SELECT a.document_id, d.title, d.doc_type, d.department, d.sensitivity,
-                          a.status, a.comment, a.created_at, d.created_by, u.name as creator_name
-                   FROM approvals a 
-                   JOIN documents d ON a.document_id = d.id
-                   JOIN users u ON d.created_by = u.id
-                   WHERE a.assigned_to=? AND a.status='pending'
-                   ORDER BY a.created_at ASC""", (current_user[0],))
-    pending = cur.fetchall()
-    
-    cur.execute("""SELECT a.document_id, d.title, a.status, a.decided_at, a.comment
-                   FROM approvals a 
-                   JOIN documents d ON a.document_id = d.id
-                   WHERE a.assigned_to=? AND a.status IN ('approved', 'rejected')
-                   ORDER BY a.decided_at DESC LIMIT 10""", (current_user[0],))
-    completed = cur.fetchall()
-    conn.close()
+    pending, completed = approvals or list_my_approvals(current_user[0])
     
     if not pending:
         st.success("No pending approvals!")
     else:
         st.write(f"You have **{len(pending)}** documents awaiting your approval:")
         
-        for i, (doc_id, title, doc_type, dept, sens, status, comment, created_at, creator_id, creator_name) in enumerate(pending):
+        progress_by_doc = get_approval_progress([row[0] for row in pending])
+        
+        for i, (doc_id, title, doc_type, dept, sens, status, comment, created_at, creator_id, creator_name,
+                version_num, file_path) in enumerate(pending):
             with st.expander(f"{title} — {doc_type} · {dept}", expanded=True):
                 col1, col2, col3 = st.columns([2, 1, 1])
                 with col1:
@@ -1648,34 +2069,11 @@ def page_my_approvals_enhanced(current_user):
                     st.write(f"**Department:** {dept}")
                     st.write(f"**Created:** {created_at[:10]}")
                 with col3:
-                    versions = list_versions(doc_id)
-                    if versions:
-                        latest_version = versions[0]
-                        version_num, file_path, _, _, _ = latest_version
-                        if os.path.exists(file_path):
-                            with open(file_path, "rb") as f:
-                                st.download_button(
-                                    f"Download v{version_num}",
-                                    data=f.read(),
-                                    file_name=os.path.basename(file_path),
-                                    key=f"download_{i}"
-                                )
+                    if file_path:
+                        lazy_download_button(f"Download v{version_num}", file_path, key=f"download_{i}")
                 
-                approvals = get_document_approvals(doc_id)
                 st.write("**Approval Progress:**")
-                
-                progress_text = []
-                for j, approval in enumerate(approvals):
-                    if approval["status"] == "approved":
-                        progress_text.append(f"✅ {approval['user_name']}")
-                    elif approval["status"] == "rejected":
-                        progress_text.append(f"❌ {approval['user_name']}")
-                    elif approval["status"] == "pending":
-                        progress_text.append(f"⏳ {approval['user_name']} (YOU)")
-                    else:
-                        progress_text.append(f"⏸️ {approval['user_name']}")
-                
-                st.write(" → ".join(progress_text))
+                st.write(progress_by_doc.get(doc_id, ""))
                 
                 st.markdown("---")
                 decision_col1, decision_col2 = st.columns([2, 1])
@@ -1739,14 +2137,18 @@ def page_upload(current_user):
                                         retention_policy, int(retention_years or 0),
                                         current_user[0], status="Draft")
         v = next_version(doc_id)
-        path = save_upload(file, doc_id, v)
-        add_version(doc_id, v, path, current_user[0], note)
+        path, sha256 = save_upload(file, doc_id, v)
+        add_version(doc_id, v, path, current_user[0], note, sha256=sha256)
         st.success(f"Uploaded v{v} for '{title}'.")
 
 def page_browse(current_user):
     st.subheader("Search & Browse")
     with st.form("search_form"):
-        q = st.text_input("Keyword search")
+        c_q, c_tag = st.columns([3, 1])
+        with c_q:
+            q = st.text_input("Keyword search")
+        with c_tag:
+            tag = st.text_input("Tag")
         c1, c2, c3, c4 = st.columns(4)
         with c1:
             dept = st.selectbox("Department", [""] + DEPARTMENTS)
@@ -1758,44 +2160,52 @@ def page_browse(current_user):
             stat = st.selectbox("Status", ["", "Draft", "Review", "Approved", "Executed"])
         submitted = st.form_submit_button("Apply filters")
 
-    rows = list_documents({"q": q, "department": dept or None, "doc_type": dtype or None,
-                           "sensitivity": sens or None, "status": stat or None})
-    if not rows:
+    filters = {"q": q, "department": dept or None, "doc_type": dtype or None,
+               "sensitivity": sens or None, "status": stat or None, "tag": tag.strip() or None}
+    total = count_documents(filters)
+    if not total:
         st.info("No documents found.")
-    for ridx, r in enumerate(rows):
+        return
+    pages = (total + BROWSE_PAGE_SIZE - 1) // BROWSE_PAGE_SIZE
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+    offset = (page - 1) * BROWSE_PAGE_SIZE
+    rows = list_documents_with_versions(filters, limit=BROWSE_PAGE_SIZE, offset=offset)
+    st.caption(f"Showing {offset + 1}–{offset + len(rows)} of {total} documents")
+    approver_ids = {u[1]: u[0] for u in get_users_by_role().get("Approver", [])}
+    for r, versions in rows:
         did, title, dept, dtype, sens, tags, status, created_at, created_by = r
         with st.expander(f"{title} — {dtype} · {dept} · {sens} · {status}"):
             st.caption(f"Created {created_at} by {created_by} • tags: {tags or '-'}")
 
-            versions = list_versions(did)
             st.write("**Versions**")
             for v, path, cat, cby, note in versions:
                 cols = st.columns([1, 2, 2, 2, 3])
                 cols[0].markdown(f"**v{v}**")
                 cols[1].markdown(cat)
                 cols[2].markdown(cby)
-                if os.path.exists(path):
-                    with open(path, "rb") as fh:
-                        cols[3].download_button("Download", file_name=os.path.basename(path), data=fh.read(), key=f"dl_{ridx}_{v}")
+                with cols[3]:
+                    lazy_download_button("Download", path, key=f"dl_{did}_{v}")
                 cols[4].markdown(note or "")
 
             st.divider()
-            st.markdown("**Workflow**")
-            users = get_users()
-            approver_names = [u[1] for u in users if u[2] == "Approver"]
-            if approver_names:
-                sel = st.selectbox("Assign approver", [""] + approver_names, key=f"sel_{ridx}")
-                if st.button("Assign", key=f"assign_{ridx}") and sel:
-                    uid = get_user_by_name(sel)[0]
-                    assign_approval(did, uid, status="pending")
-                    st.success("Approval assigned.")
-
-            st.markdown("**E-Signature**")
-            sig_name = st.text_input("Type your name to sign", key=f"sign_{ridx}")
-            if st.button("Sign document", key=f"btnsign_{ridx}") and sig_name:
-                img = add_signature_image(sig_name)
-                save_signature(did, current_user[0], "typed", img)
-                st.success("Signed and saved.")
+            _browse_row_actions(did, approver_ids, current_user)
+
+@st.fragment
+def _browse_row_actions(did: str, approver_ids: Dict[str, str], current_user):
+    """Assign/sign widgets for one browse row, keyed by document id; interacting reruns only this fragment"""
+    st.markdown("**Workflow**")
+    if approver_ids:
+        sel = st.selectbox("Assign approver", [""] + list(approver_ids), key=f"sel_{did}")
+        if st.button("Assign", key=f"assign_{did}") and sel:
+            assign_approval(did, approver_ids[sel], status="pending")
+            st.success("Approval assigned.")
+
+    st.markdown("**E-Signature**")
+    sig_name = st.text_input("Type your name to sign", key=f"sign_{did}")
+    if st.button("Sign document", key=f"btnsign_{did}") and sig_name:
+        img = add_signature_image(sig_name)
+        save_signature(did, current_user[0], "typed", img)
+        st.success("Signed and saved.")
 
 def page_start_request(current_user):
     st.subheader("Start a Request")
@@ -1823,29 +2233,17 @@ def page_start_request(current_user):
         if not (title and file):
             st.error("Please add a title and upload a file.")
             return
-        doc_id = create_document_record(title, department, doc_type, sensitivity,
-                                        [t.strip() for t in tags.split(",") if t.strip()],
-                                        retention_policy, int(retention_years or 0),
-                                        current_user[0], status="Review", description=notes)
-        v = next_version(doc_id)
-        path = save_upload(file, doc_id, v)
-        add_version(doc_id, v, path, current_user[0], f"Request init: {notes[:200]}")
-        
-        assignees = []
-        for step_name in PROCESS_TEMPLATES[process]:
-            u = get_user_by_name(step_name)
-            if u: assignees.append(u[0])
-        first_assignee = assignees[0] if assignees else ""
-        tid = create_ticket(current_user[0], process, doc_id, notes, priority, int(sla_hours), first_assignee)
-        for idx, uid in enumerate(assignees):
-            assign_approval(doc_id, uid, status="pending" if idx == 0 else "queued")
+        tid, doc_id = submit_request(current_user[0], process, title, department, doc_type, sensitivity,
+                                     [t.strip() for t in tags.split(",") if t.strip()],
+                                     retention_policy, int(retention_years or 0),
+                                     file, notes, priority, int(sla_hours))
         st.success(f"Request created. Ticket: {tid[:8]}… Document: {doc_id[:8]}…")
 
 def page_my_tasks(current_user):
     st.subheader("My Tasks")
 
     st.markdown("### Tickets")
-    tickets = list_my_tickets(current_user[0])
+    tickets, approvals = list_my_tasks(current_user[0])
     if not tickets:
         st.caption("No tickets.")
     for tid, ptype, status, prio, sla, notes, doc_id, created_at in tickets:
@@ -1860,7 +2258,7 @@ def page_my_tasks(current_user):
 
     st.markdown("---")
     st.markdown("### Approvals")
-    page_my_approvals_enhanced(current_user)
+    page_my_approvals_enhanced(current_user, approvals)
 
 def page_admin(current_user):
     st.subheader("Admin")
@@ -1869,20 +2267,17 @@ def page_admin(current_user):
         st.success("Users seeded.")
     
     st.markdown("### Audit trail (last 50)")
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT at, actor, entity, action, entity_id, details FROM audit ORDER BY at DESC LIMIT 50")
-    rows = cur.fetchall()
-    conn.close()
-    st.dataframe(rows, hide_index=True, use_container_width=True)
+    st.dataframe(recent_audit(), hide_index=True, use_container_width=True)
 
 # ============================================================
 # Main App
 # ============================================================
 @st.cache_resource
 def _bootstrap():
+    os.makedirs(FILES_DIR, exist_ok=True)
     init_db()
     seed_users()
+    get_process_assignees()
     return True
 
 def main():
@@ -1890,19 +2285,14 @@ def main():
     st.set_page_config(page_title=APP_TITLE, layout="wide")
     st.title(APP_TITLE)
 
-    users = get_users()
-    name_to_tuple = {u[1]: u for u in users}
+    name_to_tuple = get_users_by_name_map()
     st.sidebar.header("Who are you?")
     choice = st.sidebar.selectbox("User", list(name_to_tuple.keys()))
     current_user = name_to_tuple[choice]
     st.sidebar.info(f"Role: {current_user[2]}")
 
     # Show pending approvals count
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM approvals WHERE assigned_to=? AND status='pending'", (current_user[0],))
-    pending_count = cur.fetchone()[0]
-    conn.close()
+    pending_count = count_pending_approvals(current_user[0])
     
     if pending_count > 0:
         st.sidebar.error(f"🔔 {pending_count} pending approval(s)")